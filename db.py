@@ -12,5 +12,13 @@ DB_NAME = os.getenv("DB_NAME")
 
 DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}/{DB_NAME}"
 
-engine = create_engine(DATABASE_URL)
+# Pool koneksi dipakai ulang antar rerun Streamlit; pre_ping + recycle mencegah
+# error dari koneksi MySQL yang sudah ditutup server (wait_timeout)
+engine = create_engine(
+    DATABASE_URL,
+    pool_size=10,
+    max_overflow=20,
+    pool_pre_ping=True,
+    pool_recycle=1800
+)
 SessionLocal = sessionmaker(bind=engine)
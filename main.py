@@ -1,11 +1,14 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
 import io
 from db import SessionLocal
-from models import HNAData, format_currency_id
-from models_penunjang import PemeriksaanPenunjang
+from sqlalchemy.orm import scoped_session
+from models import HNAData, HNA_FILTER_COLUMNS
+from models_penunjang import PemeriksaanPenunjang, PENUNJANG_FILTER_COLUMNS
 from sidebar_manager import SidebarManager
-from fuzzywuzzy import process
+from rapidfuzz import process, fuzz
 import re
 from themes import get_theme_css  
 
@@ -21,8 +24,13 @@ st.set_page_config(
 if 'theme' not in st.session_state:
     st.session_state.theme = 'light'
 
+@st.cache_resource
+def get_session():
+    """Registry session per-thread, dibuat sekali per proses dan aman dipakai bersama"""
+    return scoped_session(SessionLocal)
+
 # Initialize session and managers
-session = SessionLocal()
+session = get_session()
 sidebar_mgr = SidebarManager(session)
 hna_mgr = HNAData(session)
 penunjang_mgr = PemeriksaanPenunjang(session)
@@ -40,52 +48,138 @@ st.markdown(
     unsafe_allow_html=True
 )
 
+_NON_WORD = re.compile(r'[^\w\s]+')
+_WS = re.compile(r'\s+')
+
 def preprocess_text(text):
     """Preprocess text untuk similarity matching yang lebih akurat"""
-    if pd.isna(text):
+    # None / NaN / pd.NA (NaN != NaN), lebih cepat dari pd.isna untuk skalar
+    if text is None or text is pd.NA or text != text:
         return ""
-    # Convert to lowercase, remove extra spaces, remove special characters
-    text = str(text).lower().strip()
-    text = re.sub(r'[^\w\s]', ' ', text)  
-    text = re.sub(r'\s+', ' ', text)  
-    return text
+    # Convert to lowercase, remove special characters, remove extra spaces
+    return _WS.sub(' ', _NON_WORD.sub(' ', str(text).lower())).strip()
+
+@st.cache_data
+def preprocess_names(names):
+    """Preprocess daftar nama unik sekali saja, hasil di-cache per tuple nama"""
+    # Sama dengan preprocess_text, tapi dijalankan sekaligus lewat accessor .str
+    processed = (
+        pd.Series(names, dtype=object).astype(str)
+        .str.lower()
+        .str.replace(_NON_WORD, ' ', regex=True)
+        .str.replace(_WS, ' ', regex=True)
+        .str.strip()
+    )
+    return dict(zip(names, processed))
 
-def advanced_similarity_search(df, query, column='nama_barang', threshold=85, limit=20):
-    """Advanced similarity search dengan multiple strategies"""
-    if not query or df.empty:
-        return df
-    
-    query_processed = preprocess_text(query)
-    choices = df[column].dropna().unique().tolist()
-    
-    if not choices:
-        return pd.DataFrame()
+def _length_candidates(query_processed, choices_processed, threshold):
+    """Index kandidat yang panjangnya masih memungkinkan skor WRatio >= threshold.
+
+    WRatio menskalakan skor 0.9 untuk rasio panjang >= 1.5 dan 0.6 untuk rasio > 8,
+    jadi kandidat di luar batas itu tidak mungkin lolos threshold yang tinggi.
+    """
+    lens = np.fromiter((len(c) for c in choices_processed), dtype=np.int64, count=len(choices_processed))
+    query_len = len(query_processed)
+    length_ratio = np.maximum(lens, query_len) / np.maximum(np.minimum(lens, query_len), 1)
     
-    # Strategy 1: Exact match (case insensitive)
-    exact_matches = df[df[column].str.lower() == query.lower()]
-    if not exact_matches.empty:
-        return exact_matches
+    mask = lens > 0
+    if threshold > 90:
+        mask &= length_ratio < 1.5
+    elif threshold > 60:
+        mask &= length_ratio <= 8
+    return np.flatnonzero(mask)
+
+def _lowered(df, column):
+    """Kolom lowercase yang sudah disiapkan saat load bila tersedia"""
+    lc_column = f"_{column}_lc"
+    return df[lc_column] if lc_column in df.columns else df[column].str.lower()
+
+def _exact(df, query, column='nama_barang'):
+    """Strategy 1: Exact match (case insensitive)"""
+    return df[_lowered(df, column) == query.lower()]
+
+def _contains(df, query, column='nama_barang'):
+    """Strategy 2: Contains match"""
+    return df[_lowered(df, column).str.contains(query.lower(), regex=False, na=False)]
+
+@st.cache_data(max_entries=64)
+def _fuzzy_names(names_key, query_processed, threshold, limit, _choices, _processed_names=None):
+    """Nama asli yang lolos fuzzy threshold, di-cache per (daftar nama, query, threshold)"""
+    if _processed_names is None:
+        _processed_names = preprocess_names(tuple(_choices))
+    choices_processed = pd.Series(_choices).map(_processed_names).to_numpy()
     
-    # Strategy 2: Contains match
-    contains_matches = df[df[column].str.lower().str.contains(query.lower(), na=False)]
-    if not contains_matches.empty:
-        return contains_matches
+    # Prefilter berdasarkan panjang sebelum scoring
+    candidate_idx = _length_candidates(query_processed, choices_processed, threshold)
+    results = process.extract(
+        query_processed, choices_processed[candidate_idx],
+        scorer=fuzz.WRatio, limit=limit, score_cutoff=threshold
+    )
     
-    # Strategy 3: Fuzzy matching dengan processed text
-    choices_processed = [preprocess_text(choice) for choice in choices]
-    results = process.extract(query_processed, choices_processed, limit=limit)
+    # Hasil sudah terfilter threshold, ambil original names lewat index
+    return [_choices[candidate_idx[idx]] for _, _, idx in results]
+
+def _fuzzy(df, query, column='nama_barang', threshold=85, limit=20, processed_names=None):
+    """Strategy 3: Fuzzy matching dengan processed text"""
+    choices = df[column].dropna().unique()
+    if len(choices) == 0:
+        return pd.DataFrame()
     
-    # Filter berdasarkan threshold dan ambil original names
-    matched_original_names = []
-    for processed_choice, score, original_choice in zip(choices_processed, [r[1] for r in results], choices):
-        if score >= threshold:
-            matched_original_names.append(original_choice)
+    # Hash daftar nama sebagai cache key; sama selama filter tidak berubah
+    names_key = pd.util.hash_pandas_object(pd.Series(choices), index=False).values.tobytes()
+    matched_original_names = _fuzzy_names(
+        names_key, preprocess_text(query), threshold, limit, choices, processed_names
+    )
     
     if matched_original_names:
         return df[df[column].isin(matched_original_names)]
     
     return pd.DataFrame()
 
+def advanced_similarity_search(df, query, column='nama_barang', threshold=85, limit=20, processed_names=None):
+    """Advanced similarity search dengan multiple strategies"""
+    if not query or df.empty:
+        return df
+    
+    matches = _exact(df, query, column)
+    if not matches.empty:
+        return matches
+    
+    matches = _contains(df, query, column)
+    if not matches.empty:
+        return matches
+    
+    return _fuzzy(df, query, column, threshold, limit, processed_names)
+
+def _filter_value(selected):
+    """Pilihan "Semua" berarti tidak ada filter untuk kolom tersebut"""
+    return None if selected == "Semua" else selected
+
+def _frame_key(df):
+    """Hash isi + nama kolom DataFrame, dipakai sebagai cache key file download"""
+    return pd.util.hash_pandas_object(df).values.tobytes() + repr(tuple(df.columns)).encode()
+
+@st.cache_data(max_entries=8)
+def build_hna_xlsx(frame_key, _download_df):
+    """Serialisasi data HNA ke xlsx, di-cache per isi data agar tidak dibuat ulang setiap rerun"""
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        _download_df.to_excel(writer, index=False, sheet_name='HNA Data')
+        
+        # Set format untuk kolom HNA di Excel (sekali per kolom)
+        worksheet = writer.sheets['HNA Data']
+        hna_col = _download_df.columns.get_loc('HNA')
+        worksheet.set_column(hna_col, hna_col, 12, writer.book.add_format({'num_format': '#,##0'}))
+    return output.getvalue()
+
+@st.cache_data(max_entries=8)
+def build_penunjang_xlsx(frame_key, _download_df):
+    """Serialisasi data pemeriksaan penunjang ke xlsx, di-cache per isi data"""
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        _download_df.to_excel(writer, index=False, sheet_name='Data Penunjang')
+    return output.getvalue()
+
 def render_upload_page(hna_mgr):
     """Render upload data page"""
     # Download template
@@ -131,33 +225,46 @@ def render_upload_page(hna_mgr):
 
 def render_data_page(hna_mgr):
     """Render data display page"""
-    df = hna_mgr.load_data()
+    filter_values = {column: hna_mgr.get_distinct_values(column) for column in HNA_FILTER_COLUMNS}
     
-    if df.empty:
+    if not any(filter_values.values()):
         st.warning("📭 Belum ada data HNA.")
         return
     
+    render_data_fragment(hna_mgr, filter_values)
+
+@st.fragment
+def render_data_fragment(hna_mgr, filter_values):
+    """Filter, pencarian dan tabel HNA; interaksi di sini hanya me-rerun fragment ini"""
+    # Rerun fragment tidak sampai ke akhir script, jadi session dilepas di sini
+    try:
+        _render_data_body(hna_mgr, filter_values)
+    finally:
+        hna_mgr.session.remove()
+
+def _render_data_body(hna_mgr, filter_values):
+    """Isi fragment data HNA"""
     # Filters
     st.subheader("🔍 Filter Data")
     col1, col2, col3, col4, col5, col6 = st.columns(6)
     
     with col1:
-        region_options = ["Semua"] + sorted(df['region'].unique().tolist())
+        region_options = ["Semua"] + filter_values['region']
         region_filter = st.selectbox("Region", region_options)
     with col2:
-        mitra_options = ["Semua"] + sorted(df['mitra'].unique().tolist())
+        mitra_options = ["Semua"] + filter_values['mitra']
         mitra_filter = st.selectbox("Mitra", mitra_options)
     with col3:
-        group_options = ["Semua"] + sorted(df['group_transaksi'].unique().tolist())
+        group_options = ["Semua"] + filter_values['group_transaksi']
         group_filter = st.selectbox("Group Transaksi", group_options)
     with col4:
-        satuan_options = ["Semua"] + sorted(df['satuan'].unique().tolist())
+        satuan_options = ["Semua"] + filter_values['satuan']
         satuan_filter = st.selectbox("Satuan", satuan_options)
     with col5:
-        bulan_options = ["Semua"] + sorted(df['periode_bulan'].unique().tolist())
+        bulan_options = ["Semua"] + filter_values['periode_bulan']
         bulan_filter = st.selectbox("Bulan", bulan_options)
     with col6:
-        tahun_options = ["Semua"] + sorted(df['periode_tahun'].unique().tolist())
+        tahun_options = ["Semua"] + filter_values['periode_tahun']
         tahun_filter = st.selectbox("Tahun", tahun_options)
     
     # Advanced search options
@@ -177,44 +284,44 @@ def render_data_page(hna_mgr):
     similarity_threshold = st.session_state.similarity_threshold
     search_mode = st.session_state.search_mode
     
-    # Apply basic filters
-    filtered_df = df.copy()
-    
-    if region_filter != "Semua":
-        filtered_df = filtered_df[filtered_df['region'] == region_filter]
-    if mitra_filter != "Semua":
-        filtered_df = filtered_df[filtered_df['mitra'] == mitra_filter]
-    if group_filter != "Semua":
-        filtered_df = filtered_df[filtered_df['group_transaksi'] == group_filter]
-    if satuan_filter != "Semua":
-        filtered_df = filtered_df[filtered_df['satuan'] == satuan_filter]
-    if bulan_filter != "Semua":
-        filtered_df = filtered_df[filtered_df['periode_bulan'] == bulan_filter]
-    if tahun_filter != "Semua":
-        filtered_df = filtered_df[filtered_df['periode_tahun'] == tahun_filter]
+    # Apply basic filters di sisi database
+    filtered_df = hna_mgr.load_data(
+        region=_filter_value(region_filter),
+        mitra=_filter_value(mitra_filter),
+        group=_filter_value(group_filter),
+        satuan=_filter_value(satuan_filter),
+        bulan=_filter_value(bulan_filter),
+        tahun=_filter_value(tahun_filter)
+    )
     
     # Apply name search
     search_results = None
-    if name_query:
+    processed_names = None
+    if name_query and not filtered_df.empty:
+        if search_mode != "Hanya Exact Match":
+            processed_names = preprocess_names(tuple(filtered_df['nama_barang'].dropna().unique()))
         if search_mode == "Hanya Exact Match":
             # Exact match only
-            search_results = filtered_df[filtered_df['nama_barang'].str.lower() == name_query.lower()]
+            search_results = _exact(filtered_df, name_query)
         elif search_mode == "Hanya Similarity":
             # Similarity only
             search_results = advanced_similarity_search(
-                filtered_df, name_query, 'nama_barang', similarity_threshold
+                filtered_df, name_query, 'nama_barang', similarity_threshold,
+                processed_names=processed_names
             )
         else:  # Auto mode
-            # Try exact match first
-            exact_matches = filtered_df[filtered_df['nama_barang'].str.lower() == name_query.lower()]
-            if not exact_matches.empty:
-                search_results = exact_matches
+            # Exact -> contains -> fuzzy, masing-masing sekali
+            search_results = _exact(filtered_df, name_query)
+            if not search_results.empty:
                 st.success("🎯 Ditemukan exact match!")
             else:
                 # Fallback to similarity
-                search_results = advanced_similarity_search(
-                    filtered_df, name_query, 'nama_barang', similarity_threshold
-                )
+                search_results = _contains(filtered_df, name_query)
+                if search_results.empty:
+                    search_results = _fuzzy(
+                        filtered_df, name_query, 'nama_barang', similarity_threshold,
+                        processed_names=processed_names
+                    )
                 if not search_results.empty:
                     st.info(f"🔍 Ditemukan {len(search_results)} hasil similarity (threshold: {similarity_threshold}%)")
                 else:
@@ -227,52 +334,44 @@ def render_data_page(hna_mgr):
     st.subheader(f"📋 Hasil Filter ({len(filtered_df)} data)")
     
     if not filtered_df.empty:
-        # BUAT COPY UNTUK DISPLAY DENGAN FORMAT
-        display_df = filtered_df.copy()
-        
-        # FORMAT KOLOM HNA untuk tampilan
-        display_df['hna_formatted'] = display_df['hna'].apply(format_currency_id)
-        
-        # Reset index untuk membuat nomor urut
-        display_df = display_df.reset_index(drop=True)
-        display_df.index = display_df.index + 1
-        display_df = display_df.rename_axis('No').reset_index()
-        
-        # Pilih kolom yang akan ditampilkan - gunakan hna_formatted
+        # Pilih kolom yang akan ditampilkan (HNA tetap numeric, format di column_config)
         selected_columns = [
-            'No', 'region', 'mitra', 'kode_item', 'nama_barang', 
-            'group_transaksi', 'satuan', 'hna_formatted', 'periode_bulan', 'periode_tahun', 
+            'region', 'mitra', 'kode_item', 'nama_barang', 
+            'group_transaksi', 'satuan', 'hna', 'periode_bulan', 'periode_tahun', 
             'uploaded_by', 'uploaded_at'
         ]
         
         # Pastikan kolom yang diminta ada dalam dataframe
-        available_columns = [col for col in selected_columns if col in display_df.columns]
-        display_df = display_df[available_columns]
+        available_columns = [col for col in selected_columns if col in filtered_df.columns]
         
         # Rename kolom untuk tampilan yang lebih baik
         column_mapping = {
-            'No': 'No',
             'region': 'Regional',
             'mitra': 'Mitra', 
             'kode_item': 'Kode Item',
             'nama_barang': 'Nama Barang',
             'group_transaksi': 'Group Transaksi',
             'satuan': 'Satuan',
-            'hna_formatted': 'HNA',
+            'hna': 'HNA',
             'periode_bulan': 'Periode Bulan',
             'periode_tahun': 'Periode Tahun',
             'uploaded_by': 'Uploaded By',
             'uploaded_at': 'Uploaded At'
         }
         
-        display_df = display_df.rename(columns=column_mapping)
+        display_df = filtered_df[available_columns].rename(columns=column_mapping)
+        
+        # Nomor urut
+        display_df.insert(0, 'No', np.arange(1, len(display_df) + 1))
         
         # Show similarity scores jika dalam mode similarity
         if name_query and search_mode in ["Auto (Exact + Similarity)", "Hanya Similarity"] and not filtered_df.empty:
-            similarity_scores = []
-            for name in filtered_df['nama_barang']:
-                score = process.extractOne(preprocess_text(name_query), [preprocess_text(name)])[1]
-                similarity_scores.append(score)
+            query_processed = preprocess_text(name_query)
+            preprocessed_names = filtered_df['nama_barang'].map(processed_names).fillna('').tolist()
+            similarity_scores = process.cdist(
+                [query_processed], preprocessed_names,
+                scorer=fuzz.WRatio, workers=-1, dtype=np.uint8
+            )[0]
             
             display_df['Similarity (%)'] = similarity_scores
             display_df = display_df.sort_values('Similarity (%)', ascending=False)
@@ -283,54 +382,44 @@ def render_data_page(hna_mgr):
         except:
             pass
         
-        # Tampilkan dataframe
-        st.dataframe(display_df, use_container_width=True, hide_index=True)
+        # Tampilkan dataframe, HNA diformat di sisi client agar tetap bisa di-sort
+        st.dataframe(
+            pa.Table.from_pandas(display_df, preserve_index=False),
+            use_container_width=True,
+            hide_index=True,
+            column_config={"HNA": st.column_config.NumberColumn("HNA", format="Rp %d")}
+        )
         
         # Download button - dengan data asli (tanpa format)
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # Untuk download, gunakan dataframe asli tanpa formatting
-            download_df = filtered_df.reset_index(drop=True)
-            download_df.index = download_df.index + 1
-            download_df = download_df.rename_axis('No').reset_index()
-            
-            # Pilih kolom untuk download (gunakan hna asli)
-            download_columns = [
-                'No', 'region', 'mitra', 'kode_item', 'nama_barang', 
-                'group_transaksi', 'satuan', 'hna', 'periode_bulan', 'periode_tahun', 
-                'uploaded_by', 'uploaded_at'
-            ]
-            download_columns = [col for col in download_columns if col in download_df.columns]
-            download_df = download_df[download_columns]
-            
-            # Rename untuk download
-            download_mapping = {
-                'No': 'No',
-                'region': 'Regional',
-                'mitra': 'Mitra', 
-                'kode_item': 'Kode Item',
-                'nama_barang': 'Nama Barang',
-                'group_transaksi': 'Group Transaksi',
-                'satuan': 'Satuan',
-                'hna': 'HNA',  
-                'periode_bulan': 'Periode Bulan',
-                'periode_tahun': 'Periode Tahun',
-                'uploaded_by': 'Uploaded By',
-                'uploaded_at': 'Uploaded At'
-            }
-            
-            download_df = download_df.rename(columns=download_mapping)
-            download_df.to_excel(writer, index=False, sheet_name='HNA Data')
-            
-            # Set format untuk kolom HNA di Excel
-            worksheet = writer.sheets['HNA Data']
-            for row in range(2, len(download_df) + 2):
-                cell = worksheet[f'H{row}']
-                cell.number_format = '#,##0'
+        # Pilih kolom untuk download (gunakan hna asli)
+        download_columns = [
+            'region', 'mitra', 'kode_item', 'nama_barang', 
+            'group_transaksi', 'satuan', 'hna', 'periode_bulan', 'periode_tahun', 
+            'uploaded_by', 'uploaded_at'
+        ]
+        download_columns = [col for col in download_columns if col in filtered_df.columns]
+        
+        # Rename untuk download
+        download_mapping = {
+            'region': 'Regional',
+            'mitra': 'Mitra', 
+            'kode_item': 'Kode Item',
+            'nama_barang': 'Nama Barang',
+            'group_transaksi': 'Group Transaksi',
+            'satuan': 'Satuan',
+            'hna': 'HNA',  
+            'periode_bulan': 'Periode Bulan',
+            'periode_tahun': 'Periode Tahun',
+            'uploaded_by': 'Uploaded By',
+            'uploaded_at': 'Uploaded At'
+        }
+        
+        download_df = filtered_df[download_columns].rename(columns=download_mapping)
+        download_df.insert(0, 'No', np.arange(1, len(download_df) + 1))
         
         st.download_button(
             label="📥 Download Data",
-            data=output.getvalue(),
+            data=build_hna_xlsx(_frame_key(download_df), download_df),
             file_name="HNA_Data.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             use_container_width=True
@@ -394,26 +483,39 @@ def render_upload_page_penunjang(penunjang_mgr):
 
 def render_data_page_penunjang(penunjang_mgr):
     """Render data display page pemeriksaan penunjang"""
-    df = penunjang_mgr.load_data()
-    if df.empty:
+    filter_values = {column: penunjang_mgr.get_distinct_values(column) for column in PENUNJANG_FILTER_COLUMNS}
+    if not any(filter_values.values()):
         st.warning("📭 Belum ada data Pemeriksaan Penunjang.")
         return          
 
     # untuk mendapatkan daftar kolom tambahan yang tersedia
     available_columns = penunjang_mgr.get_available_columns()
 
+    render_data_fragment_penunjang(penunjang_mgr, filter_values, available_columns)
+
+@st.fragment
+def render_data_fragment_penunjang(penunjang_mgr, filter_values, available_columns):
+    """Filter, pencarian dan tabel pemeriksaan penunjang; interaksi di sini hanya me-rerun fragment ini"""
+    # Rerun fragment tidak sampai ke akhir script, jadi session dilepas di sini
+    try:
+        _render_data_body_penunjang(penunjang_mgr, filter_values, available_columns)
+    finally:
+        penunjang_mgr.session.remove()
+
+def _render_data_body_penunjang(penunjang_mgr, filter_values, available_columns):
+    """Isi fragment data pemeriksaan penunjang"""
     # Filter dan pencarian
     st.subheader("🔍 Filter Data Pemeriksaan Penunjang")
     col1, col2, col3, col4, col5 = st.columns(5)
 
     with col1:
-        mitra_options = ["Semua"] + sorted(df['mitra'].unique().tolist())
+        mitra_options = ["Semua"] + filter_values['mitra']
         mitra_filter = st.selectbox("Mitra", mitra_options)
     with col2:
-        group_options = ["Semua"] + sorted(df['group_transaksi'].unique().tolist())
+        group_options = ["Semua"] + filter_values['group_transaksi']
         group_filter = st.selectbox("Group Transaksi", group_options)
     with col3:
-        satuan_options = ["Semua"] + sorted(df['satuan'].unique().tolist())
+        satuan_options = ["Semua"] + filter_values['satuan']
         satuan_filter = st.selectbox("Satuan", satuan_options)
     with col4:
         kelas_options = ["Semua"] + available_columns
@@ -421,16 +523,15 @@ def render_data_page_penunjang(penunjang_mgr):
     with col5:
         search_query = st.text_input("Cari Deskripsi", placeholder="Cari nama pemeriksaan...")  
 
-    # Apply filters
-    filtered_df = df.copy()
+    # Apply filters di sisi database
+    filtered_df = penunjang_mgr.load_data(
+        mitra=_filter_value(mitra_filter),
+        group=_filter_value(group_filter),
+        satuan=_filter_value(satuan_filter),
+        kelas=_filter_value(kelas_filter)
+    )
 
-    if mitra_filter != "Semua":
-        filtered_df = filtered_df[filtered_df['mitra'] == mitra_filter]
-    if group_filter != "Semua":
-        filtered_df = filtered_df[filtered_df['group_transaksi'] == group_filter]
-    if satuan_filter != "Semua":
-        filtered_df = filtered_df[filtered_df['satuan'] == satuan_filter]
-    if search_query:
+    if search_query and not filtered_df.empty:
         filtered_df = filtered_df[filtered_df['deskripsi'].str.contains(search_query, case=False, na=False)]
     
     # Display results
@@ -438,31 +539,23 @@ def render_data_page_penunjang(penunjang_mgr):
 
     if not filtered_df.empty:
         # Siapkan data untuk ditampilkan
-        display_data = []
-
-        for _, row in filtered_df.iterrows():
-            base_data = {
-                'Mitra': row['mitra'],
-                'Kode': row['kode'],
-                'Deskripsi': row['deskripsi'],
-                'Group Transaksi': row['group_transaksi'],
-                'Satuan': row['satuan']
-            }
-
-            if kelas_filter != "Semua" and row['additional_data']:
-                base_data['Kelas'] = row['additional_data'].get(kelas_filter, '')
-
-            display_data.append(base_data)
+        base_columns = {
+            'mitra': 'Mitra',
+            'kode': 'Kode',
+            'deskripsi': 'Deskripsi',
+            'group_transaksi': 'Group Transaksi',
+            'satuan': 'Satuan'
+        }
+        display_df = filtered_df[list(base_columns)].rename(columns=base_columns)
 
-        display_df = pd.DataFrame(display_data)
+        if kelas_filter != "Semua":
+            display_df['Kelas'] = filtered_df['kelas'].fillna('')
 
-        # Reset index untuk nomor urut
-        display_df = display_df.reset_index(drop=True)
-        display_df.index = display_df.index + 1
-        display_df = display_df.rename_axis('No').reset_index()
+        # Nomor urut
+        display_df.insert(0, 'No', np.arange(1, len(display_df) + 1))
         
         # Tampilkan dataframe
-        st.dataframe(display_df, use_container_width=True, hide_index=True)
+        st.dataframe(pa.Table.from_pandas(display_df, preserve_index=False), use_container_width=True, hide_index=True)
         
         # Detail view untuk setiap item
         st.subheader("🔍 Detail Pemeriksaan Penunjang")
@@ -471,7 +564,7 @@ def render_data_page_penunjang(penunjang_mgr):
             selected_item = filtered_df.iloc[0]
         else:
             # Pilih item untuk melihat detail
-            item_options = [f"{row['kode']} - {row['deskripsi']}" for _, row in filtered_df.iterrows()]
+            item_options = [f"{kode} - {deskripsi}" for kode, deskripsi in zip(filtered_df['kode'], filtered_df['deskripsi'])]
             selected_item_idx = st.selectbox("Pilih item untuk melihat detail:", range(len(item_options)), format_func=lambda x: item_options[x])
             selected_item = filtered_df.iloc[selected_item_idx]
         
@@ -496,32 +589,19 @@ def render_data_page_penunjang(penunjang_mgr):
             else:
                 st.write("Tidak ada data tambahan")
         
-        # Download button
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:            # Siapkan data untuk download (termasuk semua kolom tambahan)
-            download_data = []
-            for _, row in filtered_df.iterrows():
-                row_data = {
-                    'Mitra': row['mitra'],
-                    'Kode': row['kode'],
-                    'Deskripsi': row['deskripsi'],
-                    'Group Transaksi': row['group_transaksi'],
-                    'Satuan': row['satuan']
-                }
-                
-                # Tambahkan semua kolom tambahan
-                additional_data = row.get('additional_data', {})
-                for col in available_columns:
-                    row_data[col] = additional_data.get(col, '')
-                
-                download_data.append(row_data)
-            
-            download_df = pd.DataFrame(download_data)
-            download_df.to_excel(writer, index=False, sheet_name='Data Penunjang')
+        # Download button - siapkan data (termasuk semua kolom tambahan)
+        base_df = filtered_df[list(base_columns)].rename(columns=base_columns).reset_index(drop=True)
+        
+        # Tambahkan semua kolom tambahan
+        additional_df = pd.DataFrame(
+            filtered_df['additional_data'].tolist(), columns=available_columns
+        ).fillna('')
+        
+        download_df = pd.concat([base_df, additional_df], axis=1)
         
         st.download_button(
             label="📥 Download Data Pemeriksaan Penunjang",
-            data=output.getvalue(),
+            data=build_penunjang_xlsx(_frame_key(download_df), download_df),
             file_name="Pemeriksaan_Penunjang_Data.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             use_container_width=True
@@ -552,27 +632,31 @@ def render_user_management_page(user_mgr):
             else:
                 user_mgr.add_user(new_user, new_pass, role)
 
-# Render sidebar and get selected page
-selected_page = sidebar_mgr.render_sidebar()
+try:
+    # Render sidebar and get selected page
+    selected_page = sidebar_mgr.render_sidebar()
 
-# Main content based on selected page
-if st.session_state['login']:
-    if selected_page == "Upload Data":
-        st.title("📤 Upload Data HNA")
-        render_upload_page(hna_mgr)
+    # Main content based on selected page
+    if st.session_state['login']:
+        if selected_page == "Upload Data":
+            st.title("📤 Upload Data HNA")
+            render_upload_page(hna_mgr)
         
-    elif selected_page == "Tampilan Data":
-        st.title("📊 Data HNA")
-        render_data_page(hna_mgr)
+        elif selected_page == "Tampilan Data":
+            st.title("📊 Data HNA")
+            render_data_page(hna_mgr)
 
-    elif selected_page == "Upload Penunjang":
-        st.title("🩺 Upload Data Pemeriksaan Penunjang")
-        render_upload_page_penunjang(penunjang_mgr)
+        elif selected_page == "Upload Penunjang":
+            st.title("🩺 Upload Data Pemeriksaan Penunjang")
+            render_upload_page_penunjang(penunjang_mgr)
     
-    elif selected_page == "Tampilan Penunjang":
-        st.title("📋 Data Pemeriksaan Penunjang")
-        render_data_page_penunjang(penunjang_mgr)
+        elif selected_page == "Tampilan Penunjang":
+            st.title("📋 Data Pemeriksaan Penunjang")
+            render_data_page_penunjang(penunjang_mgr)
         
-    elif selected_page == "Manajemen User":
-        st.title("👥 Manajemen User")
-        render_user_management_page(sidebar_mgr.user_mgr)
\ No newline at end of file
+        elif selected_page == "Manajemen User":
+            st.title("👥 Manajemen User")
+            render_user_management_page(sidebar_mgr.user_mgr)
+finally:
+    # Kembalikan koneksi ke pool setelah script selesai, termasuk saat halaman error
+    session.remove()
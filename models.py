@@ -1,7 +1,6 @@
 import pandas as pd
 import streamlit as st
 from sqlalchemy import text
-from fuzzywuzzy import process
 
 def format_currency_id(value):
     """Format angka menjadi format mata uang Indonesia (15.700.000)"""
@@ -15,6 +14,29 @@ def format_currency_id(value):
     except (ValueError, TypeError):
         return str(value)        
 
+# Kolom yang boleh dipakai sebagai filter / sumber opsi dropdown
+HNA_FILTER_COLUMNS = ['region', 'mitra', 'group_transaksi', 'satuan', 'periode_bulan', 'periode_tahun']
+
+@st.cache_data(ttl=300)
+def _load_hna(_engine, filters=()):
+    """Query tabel hna_data dengan WHERE dari filters, di-cache per kombinasi filter"""
+    query = "SELECT * FROM hna_data"
+    if filters:
+        query += " WHERE " + " AND ".join(f"{column} = :{column}" for column, _ in filters)
+    query += " ORDER BY uploaded_at DESC"
+    df = pd.read_sql(text(query), _engine, params=dict(filters))
+    
+    # Nama lowercase disiapkan sekali di sini untuk exact/contains search,
+    # disimpan sebagai string Arrow agar operasi .str berjalan di kernel C
+    df['_nama_barang_lc'] = df['nama_barang'].fillna('').astype('string[pyarrow]').str.lower()
+    return df
+
+@st.cache_data(ttl=300)
+def _distinct_hna(_engine, column):
+    """Nilai unik satu kolom hna_data untuk opsi dropdown filter"""
+    query = f"SELECT DISTINCT {column} FROM hna_data WHERE {column} IS NOT NULL"
+    return pd.read_sql(text(query), _engine)[column].tolist()
+
 class UserManager:
     def __init__(self, session):
         self.session = session
@@ -60,7 +82,7 @@ class HNAData:
 
     def upload_excel(self, file, region, mitra, bulan, tahun, user):
         try:
-            df = pd.read_excel(file)
+            df = pd.read_excel(file, sheet_name=0, engine='calamine')
             expected_cols = ["Kode Item","Nama Barang","Group Transaki","Satuan", "HNA"]
             if list(df.columns) != expected_cols:
                 st.error("Format kolom tidak sesuai template!")
@@ -97,18 +119,33 @@ class HNAData:
                 success_count += 1
                 
             self.session.commit()
+            st.cache_data.clear()
             st.success(f"File berhasil diupload! {success_count} data tersimpan.")
         except Exception as e:
             st.error(f"Error upload: {e}")
 
-    def load_data(self):
+    def load_data(self, region=None, mitra=None, group=None, satuan=None, bulan=None, tahun=None):
         try:
-            df = pd.read_sql("SELECT * FROM hna_data ORDER BY uploaded_at DESC", self.session.bind)
+            values = [region, mitra, group, satuan, bulan, tahun]
+            filters = tuple(
+                (column, value) for column, value in zip(HNA_FILTER_COLUMNS, values) if value is not None
+            )
+            df = _load_hna(self.session.bind, filters)
             return df
         except Exception as e:
             st.error(f"Error loading data: {e}")
             return pd.DataFrame()
 
+    def get_distinct_values(self, column):
+        """Mendapatkan nilai unik kolom untuk opsi filter"""
+        if column not in HNA_FILTER_COLUMNS:
+            raise ValueError(f"Kolom {column} tidak bisa dipakai sebagai filter")
+        try:
+            return sorted(_distinct_hna(self.session.bind, column))
+        except Exception as e:
+            st.error(f"Error getting filter options: {e}")
+            return []
+
     def filter_data(self, df, region=None, mitra=None, group=None, bulan=None, tahun=None):
         if region: df = df[df['region'] == region]
         if mitra: df = df[df['mitra'] == mitra]
@@ -3,13 +3,49 @@ import streamlit as st
 from sqlalchemy import text
 import json
 
+# Kolom yang boleh dipakai sebagai filter / sumber opsi dropdown
+PENUNJANG_FILTER_COLUMNS = ['mitra', 'group_transaksi', 'satuan']
+
+def _json_path(key):
+    """JSON path MySQL untuk satu key di additional_data (key di-quote agar aman dari spasi/titik)"""
+    return '$."' + key.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+@st.cache_data(ttl=300)
+def _load_penunjang(_engine, filters=(), kelas=None):
+    """Query tabel pemeriksaan_penunjang + parse JSON, di-cache per kombinasi filter dan kelas"""
+    params = dict(filters)
+    query = "SELECT *"
+    if kelas:
+        # Nilai kelas diambil langsung oleh MySQL dari additional_data
+        query += ", JSON_UNQUOTE(JSON_EXTRACT(additional_data, :kelas_path)) AS kelas"
+        params['kelas_path'] = _json_path(kelas)
+    query += " FROM pemeriksaan_penunjang"
+    if filters:
+        query += " WHERE " + " AND ".join(f"{column} = :{column}" for column, _ in filters)
+    query += " ORDER BY uploaded_at DESC"
+    df = pd.read_sql(text(query), _engine, params=params)
+    
+    # Parse JSON additional_data, kecuali driver sudah mengembalikan dict (kolom tipe JSON)
+    if not df.empty and 'additional_data' in df.columns:
+        df['additional_data'] = df['additional_data'].apply(
+            lambda x: x if isinstance(x, dict) else (json.loads(x) if x else {})
+        )
+    
+    return df
+
+@st.cache_data(ttl=300)
+def _distinct_penunjang(_engine, column):
+    """Nilai unik satu kolom pemeriksaan_penunjang untuk opsi dropdown filter"""
+    query = f"SELECT DISTINCT {column} FROM pemeriksaan_penunjang WHERE {column} IS NOT NULL"
+    return pd.read_sql(text(query), _engine)[column].tolist()
+
 class PemeriksaanPenunjang:
     def __init__(self, session):
         self.session = session
 
     def upload_excel(self, file, mitra, user):
         try:
-            df = pd.read_excel(file)
+            df = pd.read_excel(file, sheet_name=0, engine='calamine')
             
             # Kolom pakem yang wajib ada
             expected_base_cols = ["KODE", "DESKRIPSI", "GROUP TRANSAKSI", "SATUAN"]
@@ -23,75 +59,82 @@ class PemeriksaanPenunjang:
             # Identifikasi kolom tambahan (selain kolom pakem)
             additional_cols = [col for col in df.columns if col not in expected_base_cols]
             
-            # Simpan metadata kolom tambahan ke database
-            for col in additional_cols:
-                try:
-                    stmt = text("""
-                        INSERT IGNORE INTO pemeriksaan_columns_metadata (column_name, display_name, created_by)
-                        VALUES (:column_name, :display_name, :created_by)
-                    """)
-                    self.session.execute(stmt, {
-                        "column_name": col,
-                        "display_name": col,
-                        "created_by": user
-                    })
-                except Exception as e:
-                    st.warning(f"Kolom {col} sudah ada atau error: {e}")
+            # Simpan metadata kolom tambahan ke database (satu kali executemany,
+            # INSERT IGNORE sudah melewati kolom yang sudah terdaftar)
+            if additional_cols:
+                stmt = text("""
+                    INSERT IGNORE INTO pemeriksaan_columns_metadata (column_name, display_name, created_by)
+                    VALUES (:column_name, :display_name, :created_by)
+                """)
+                self.session.execute(stmt, [
+                    {"column_name": col, "display_name": col, "created_by": user}
+                    for col in additional_cols
+                ])
             
             self.session.commit()
             
-            # Proses setiap baris data
-            success_count = 0
-            for _, row in df.iterrows():
-                # Skip empty rows
-                if pd.isna(row['KODE']) or pd.isna(row['DESKRIPSI']):
-                    continue
-                
-                # Siapkan data tambahan dalam format JSON
-                additional_data = {}
-                for col in additional_cols:
-                    if not pd.isna(row[col]):
-                        additional_data[col] = str(row[col])
-                
-                # Insert data utama
+            # Skip empty rows
+            df = df.dropna(subset=['KODE', 'DESKRIPSI'])
+            
+            # Siapkan semua baris sekaligus, data tambahan dalam format JSON
+            additional_records = df[additional_cols].to_dict('records')
+            params = [
+                {
+                    "mitra": mitra,
+                    "kode": kode,
+                    "deskripsi": deskripsi,
+                    "group_transaksi": group_transaksi,
+                    "satuan": satuan,
+                    "additional_data": json.dumps({
+                        col: str(value) for col, value in additional.items() if not pd.isna(value)
+                    }),
+                    "user": user
+                }
+                for kode, deskripsi, group_transaksi, satuan, additional in zip(
+                    df['KODE'], df['DESKRIPSI'], df['GROUP TRANSAKSI'], df['SATUAN'], additional_records
+                )
+            ]
+            
+            # Insert data utama dalam satu executemany
+            if params:
                 stmt = text("""
                     INSERT INTO pemeriksaan_penunjang 
                     (mitra, kode, deskripsi, group_transaksi, satuan, additional_data, uploaded_by)
                     VALUES (:mitra, :kode, :deskripsi, :group_transaksi, :satuan, :additional_data, :user)
                 """)
-                self.session.execute(stmt, {
-                    "mitra": mitra,
-                    "kode": row['KODE'],
-                    "deskripsi": row['DESKRIPSI'],
-                    "group_transaksi": row['GROUP TRANSAKSI'],
-                    "satuan": row['SATUAN'],
-                    "additional_data": json.dumps(additional_data),
-                    "user": user
-                })
-                success_count += 1
+                self.session.execute(stmt, params)
+            success_count = len(params)
                 
             self.session.commit()
+            st.cache_data.clear()
             st.success(f"✅ File berhasil diupload! {success_count} data pemeriksaan penunjang tersimpan.")
             st.info(f"📝 Kolom tambahan terdeteksi: {', '.join(additional_cols) if additional_cols else 'Tidak ada'}")
             
         except Exception as e:
             st.error(f"❌ Error upload: {e}")
 
-    def load_data(self):
+    def load_data(self, mitra=None, group=None, satuan=None, kelas=None):
         try:
-            df = pd.read_sql("SELECT * FROM pemeriksaan_penunjang ORDER BY uploaded_at DESC", self.session.bind)
-            
-            # Parse JSON additional_data
-            if not df.empty and 'additional_data' in df.columns:
-                df['additional_data'] = df['additional_data'].apply(
-                    lambda x: json.loads(x) if x else {}
-                )
-            
+            values = [mitra, group, satuan]
+            filters = tuple(
+                (column, value) for column, value in zip(PENUNJANG_FILTER_COLUMNS, values) if value is not None
+            )
+            df = _load_penunjang(self.session.bind, filters, kelas)
             return df
         except Exception as e:
             st.error(f"Error loading data: {e}")
             return pd.DataFrame()
 
+    def get_distinct_values(self, column):
+        """Mendapatkan nilai unik kolom untuk opsi filter"""
+        if column not in PENUNJANG_FILTER_COLUMNS:
+            raise ValueError(f"Kolom {column} tidak bisa dipakai sebagai filter")
+        try:
+            return sorted(_distinct_penunjang(self.session.bind, column))
+        except Exception as e:
+            st.error(f"Error getting filter options: {e}")
+            return []
+
     def get_available_columns(self):
         """Mendapatkan daftar kolom tambahan yang tersedia"""
         try:
@@ -1,6 +1,7 @@
 import pandas as pd
 from db import SessionLocal
-from fuzzywuzzy import process
+from rapidfuzz import process
+from rapidfuzz.utils import default_process
 
 def load_data():
     session = SessionLocal()
@@ -23,5 +24,5 @@ def filter_data(df, region=None, mitra=None, group=None, bulan=None, tahun=None)
 
 def search_similarity(df, query, column='nama_barang', limit=10):
     choices = df[column].tolist()
-    results = process.extract(query, choices, limit=limit)
-    return pd.DataFrame(results, columns=[column, 'Similarity'])
+    results = process.extract(query, choices, limit=limit, processor=default_process)
+    return pd.DataFrame([(choice, score) for choice, score, _ in results], columns=[column, 'Similarity'])